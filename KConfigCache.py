@@ -0,0 +1,130 @@
+#	searchkconfig - Search Linux kernel KConfig files.
+#	Copyright (C) 2017-2017 Johannes Bauer
+#
+#	This file is part of searchkconfig.
+#
+#	searchkconfig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	searchkconfig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with searchkconfig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import os
+import io
+import collections
+import hashlib
+import pickle
+import tempfile
+
+class FileFingerprint(collections.namedtuple("FileFingerprint", [ "mtime_ns", "size", "digest" ])):
+	@classmethod
+	def read(cls, filename):
+		# Returns the fingerprint together with the decoded text so that
+		# hashing does not require reading the file twice
+		with open(filename, "rb") as f:
+			data = f.read()
+			stat = os.fstat(f.fileno())
+		fingerprint = cls(mtime_ns = stat.st_mtime_ns, size = stat.st_size, digest = hashlib.sha256(data).hexdigest())
+		text = io.StringIO(data.decode(), newline = None)
+		return (fingerprint, text)
+
+	def still_valid(self, filename):
+		try:
+			stat = os.stat(filename)
+		except FileNotFoundError:
+			return False
+		if stat.st_size != self.size:
+			return False
+		if stat.st_mtime_ns == self.mtime_ns:
+			return True
+
+		# File was touched, but might still have identical content
+		with open(filename, "rb") as f:
+			return hashlib.sha256(f.read()).hexdigest() == self.digest
+
+class KConfigCache(object):
+	# Increment whenever the pickled object model changes
+	_CACHE_VERSION = 13
+
+	def __init__(self, cachedir):
+		self._cachedir = cachedir
+		if not self._cachedir.endswith("/"):
+			self._cachedir += "/"
+
+	@staticmethod
+	def default_cachedir():
+		cache_home = os.environ.get("XDG_CACHE_HOME")
+		if cache_home is None:
+			cache_home = os.path.expanduser("~/.cache")
+		return cache_home + "/searchkconfig"
+
+	def _tree_filename(self, basedir, startfile, replacements):
+		key = repr((self._CACHE_VERSION, basedir, startfile, sorted(replacements.items())))
+		return self._cachedir + "tree_" + hashlib.sha256(key.encode()).hexdigest() + ".pickle"
+
+	def _events_filename(self, digest):
+		return "%sfiles_v%d/%s/%s.pickle" % (self._cachedir, self._CACHE_VERSION, digest[:2], digest)
+
+	def _load(self, filename):
+		try:
+			with open(filename, "rb") as f:
+				return pickle.load(f)
+		except FileNotFoundError:
+			return None
+		except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+			# Stale or corrupted cache file, treat as cache miss
+			return None
+
+	def _store(self, filename, data):
+		dirname = os.path.dirname(filename)
+		try:
+			os.makedirs(dirname, exist_ok = True)
+			(fd, tmpname) = tempfile.mkstemp(dir = dirname, prefix = ".tmp_")
+		except OSError:
+			# Cache directory cannot be written, simply do not cache
+			return
+		try:
+			with os.fdopen(fd, "wb") as f:
+				pickle.dump(data, f, protocol = pickle.HIGHEST_PROTOCOL)
+			os.replace(tmpname, filename)
+		except OSError:
+			os.unlink(tmpname)
+		except:
+			os.unlink(tmpname)
+			raise
+
+	def load_tree(self, basedir, startfile, replacements):
+		# Returns the stored tree or None if there is no cache entry or any of
+		# the sourced files has changed since
+		data = self._load(self._tree_filename(basedir, startfile, replacements))
+		if data is None:
+			return None
+		(fingerprints, tree) = data
+		for (filename, fingerprint) in fingerprints.items():
+			if not fingerprint.still_valid(basedir + filename):
+				return None
+		return tree
+
+	def store_tree(self, basedir, startfile, replacements, fingerprints, tree):
+		# The tree is anything picklable that was derived from the parsed
+		# files, e.g., the root node together with lookup structures
+		self._store(self._tree_filename(basedir, startfile, replacements), (fingerprints, tree))
+
+	def load_file_events(self, digest):
+		# Per-file event lists are keyed only by content hash, so they are
+		# shared between kernel trees, architectures and branches
+		return self._load(self._events_filename(digest))
+
+	def store_file_events(self, digest, events):
+		self._store(self._events_filename(digest), events)
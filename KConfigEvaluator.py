@@ -0,0 +1,215 @@
+#	searchkconfig - Search Linux kernel KConfig files.
+#	Copyright (C) 2017-2017 Johannes Bauer
+#
+#	This file is part of searchkconfig.
+#
+#	searchkconfig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	searchkconfig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with searchkconfig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+
+import enum
+from KConfigObjects import Symbol, Literal, Comparison
+from KernelConfiguration import ConfigOptionState
+
+class Tristate(enum.IntEnum):
+	No = 0
+	Module = 1
+	Yes = 2
+
+class KConfigEvaluator(object):
+	# Evaluates dependency expressions against a kernel configuration with
+	# Kconfig semantics: "&&" is the minimum, "||" the maximum and "!" the
+	# complement of tristate values, comparisons yield y or n. Results are
+	# memoized per expression, so a condition that is shared by many items
+	# (e.g., the one of an enclosing "if" block) is only evaluated once.
+	# $(...) invocations are not executed, their value is unknown (None).
+	# An expression with an unknown operand is unknown as well, unless the
+	# other operand alone decides it, e.g., "n && $(...)" is n.
+	_STATE_STRINGS = {
+		ConfigOptionState.Enabled:	"y",
+		ConfigOptionState.Disabled:	"n",
+		ConfigOptionState.Module:	"m",
+	}
+	_TRISTATES = {
+		"y":	Tristate.Yes,
+		"m":	Tristate.Module,
+		"n":	Tristate.No,
+	}
+
+	def __init__(self, kconfig, symbols = None):
+		# symbols is the collection of defined Symbol objects, if known
+		self._kconfig = kconfig
+		self._symbols = symbols
+		self._memo = { }
+
+	@property
+	def kconfig(self):
+		return self._kconfig
+
+	def _symbol_string(self, symbol):
+		state = self._kconfig.state(symbol)
+		if state != 0:
+			return self._STATE_STRINGS[state]
+		value = self._kconfig[symbol.name]
+		if value is None:
+			# Kconfig gives symbols that are never defined (which includes
+			# numbers, the grammar does not distinguish them) their name as
+			# value. Unset defined symbols are taken to be n.
+			if self._symbols is None:
+				undefined = self._number(symbol.name) is not None
+			else:
+				undefined = symbol not in self._symbols
+			return symbol.name if undefined else "n"
+		else:
+			# Numbers are compared numerically again in _compare()
+			return str(value)
+
+	def _string_value(self, expr):
+		if isinstance(expr, Symbol):
+			return self._symbol_string(expr)
+		elif isinstance(expr, Literal):
+			return expr.value
+		else:
+			value = self.evaluate(expr)
+			return None if (value is None) else value.name[0].lower()
+
+	@staticmethod
+	def _number(value):
+		try:
+			if value.lower().startswith("0x"):
+				return int(value, 16)
+			else:
+				return int(value)
+		except ValueError:
+			return None
+
+	def _compare(self, expr):
+		lhs = self._string_value(expr.lhs)
+		rhs = self._string_value(expr.rhs)
+		if (lhs is None) or (rhs is None):
+			return None
+		(lhs_number, rhs_number) = (self._number(lhs), self._number(rhs))
+		if (lhs_number is not None) and (rhs_number is not None):
+			(lhs, rhs) = (lhs_number, rhs_number)
+		result = {
+			"=":	lambda: lhs == rhs,
+			"!=":	lambda: lhs != rhs,
+			"<":	lambda: lhs < rhs,
+			"<=":	lambda: lhs <= rhs,
+			">":	lambda: lhs > rhs,
+			">=":	lambda: lhs >= rhs,
+		}[expr.op]()
+		return Tristate.Yes if result else Tristate.No
+
+	def _evaluate(self, expr):
+		if isinstance(expr, (Symbol, Literal)):
+			# Anything that is not a tristate value is n in a boolean context
+			return self._TRISTATES.get(self._string_value(expr), Tristate.No)
+		elif not isinstance(expr, Comparison):
+			# E.g., $(shell ...) invocations, which are not executed
+			return None
+		elif expr.op == "!":
+			value = self.evaluate(expr.rhs)
+			return None if (value is None) else Tristate(Tristate.Yes - value)
+		elif expr.op == "&&":
+			return self._combine(min, Tristate.No, expr)
+		elif expr.op == "||":
+			return self._combine(max, Tristate.Yes, expr)
+		else:
+			return self._compare(expr)
+
+	def _combine(self, function, dominant, expr):
+		(lhs, rhs) = (self.evaluate(expr.lhs), self.evaluate(expr.rhs))
+		if (lhs == dominant) or (rhs == dominant):
+			return dominant
+		elif (lhs is None) or (rhs is None):
+			return None
+		else:
+			return function(lhs, rhs)
+
+	def evaluate(self, expr):
+		# Returns a Tristate or None if the value of expr is unknown
+		try:
+			return self._memo[expr]
+		except KeyError:
+			result = self._evaluate(expr)
+			self._memo[expr] = result
+			return result
+
+	def blocking_clause(self, expr):
+		# Returns the innermost part of expr that makes it evaluate to n by
+		# following failing operands of "&&", or None if expr is satisfied
+		# or unknown. A clause that is reported is therefore always known to
+		# be n, never a $(...) invocation that was not executed.
+		if self.evaluate(expr) != Tristate.No:
+			return None
+		while isinstance(expr, Comparison) and (expr.op == "&&"):
+			if self.evaluate(expr.lhs) == Tristate.No:
+				expr = expr.lhs
+			else:
+				expr = expr.rhs
+		return expr
+
+if __name__ == "__main__":
+	# Regression cases: each condition is parsed by both the grammar and
+	# the fast path, then evaluated against a fixed configuration. Checks
+	# operator precedence and which clause is reported as blocking.
+	import sys
+	import tempfile
+	from KConfigParser import KConfigParser
+	from KConfigFastParser import KConfigFastParser
+	from KernelConfiguration import KernelConfiguration
+
+	config = "\n".join([
+		"CONFIG_A=y",
+		"CONFIG_B=m",
+		"CONFIG_N=5",
+		"# CONFIG_UML is not set",
+	])
+	cases = [
+		# (condition, value, blocking clause)
+		("!UML && HAVE_PCI",			Tristate.No,		"HAVE_PCI"),
+		("!C && B",						Tristate.Module,	None),
+		("A = y && C",					Tristate.No,		"C"),
+		("N > 3 && C",					Tristate.No,		"C"),
+		("A && B || C",					Tristate.Module,	None),
+		("C || A && B",					Tristate.Module,	None),
+		("!A || B",						Tristate.Module,	None),
+		("!(A && B)",					Tristate.Module,	None),
+		("A != n && !B = m",			Tristate.Yes,		None),
+		("C && $(cc-option,-mfoo)",		Tristate.No,		"C"),
+		("A && $(cc-option,-mfoo)",		None,				None),
+	]
+
+	with tempfile.NamedTemporaryFile("w", suffix = ".config") as f:
+		print(config, file = f, flush = True)
+		evaluator = KConfigEvaluator(KernelConfiguration(f.name))
+	configparser = KConfigParser()
+	fastparser = KConfigFastParser()
+	failures = 0
+	for (condition, value, blocking_clause) in cases:
+		line = "depends on " + condition
+		expr = configparser.parse("ConfigurationItem", line).dependency
+		fast = fastparser.parse("depends", line)
+		clause = evaluator.blocking_clause(expr)
+		result = (evaluator.evaluate(expr), None if (clause is None) else str(clause))
+		ok = (result == (value, blocking_clause)) and ((fast is None) or (fast.dependency is expr))
+		if not ok:
+			failures += 1
+		print("%s %-30s %-40s value %s, blocked by %s" % ("ok  " if ok else "FAIL", condition, str(expr), result[0], result[1]))
+	print("%d cases, %d failures." % (len(cases), failures))
+	sys.exit(0 if (failures == 0) else 1)
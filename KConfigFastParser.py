@@ -0,0 +1,303 @@
+#!/usr/bin/python3
+#	searchkconfig - Search Linux kernel KConfig files.
+#	Copyright (C) 2017-2017 Johannes Bauer
+#
+#	This file is part of searchkconfig.
+#
+#	searchkconfig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	searchkconfig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with searchkconfig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import re
+from KConfigParser import _to_int
+from KConfigObjects import Symbol, Source, ConfigurationItem, Menu, ConfigType, Option, Comparison, DefaultValue, DependsOn, Select, DefType, Conditional, Range, Comment, Imply, VisibleIf, Literal
+
+class _NoFastPath(Exception):
+	pass
+
+class KConfigFastParser(object):
+	# Handles the most common shapes of Kconfig lines without going through
+	# TPG. It mirrors the (PEG-like) semantics of the KConfigParser grammar
+	# exactly and gives up by returning None whenever a line leaves the
+	# simple subset, in which case the caller has to use the grammar.
+	_WHITESPACE_RE = re.compile(r"\s*")
+	_SYMBOL_RE = re.compile(r"[-A-Za-z0-9_]+")
+	_INTVAL_RE = re.compile(r"0x[0-9a-fA-F]+|-?\d+")
+	_CMP_OP_RE = re.compile(r"=|!=|>=|<=|>|<")
+	_IF_RE = re.compile(r"if\b")
+	_QUOTED_RE = {
+		"\"":	re.compile(r"\"([^\"\\]*)\""),
+		"'":	re.compile(r"'([^'\\]*)'"),
+	}
+
+	def __init__(self):
+		self._dispatch = {
+			"config":		self._parse_config,
+			"menuconfig":	self._parse_config,
+			"menu":			self._parse_menu,
+			"mainmenu":		self._parse_menu,
+			"source":		self._parse_source,
+			"comment":		self._parse_comment,
+			"string":		self._parse_type,
+			"hex":			self._parse_type,
+			"boolean":		self._parse_type,
+			"bool":			self._parse_type,
+			"prompt":		self._parse_type,
+			"tristate":		self._parse_type,
+			"int":			self._parse_type,
+			"def_bool":		self._parse_deftype,
+			"def_tristate":	self._parse_deftype,
+			"range":		self._parse_range,
+			"depends":		self._parse_depends_on,
+			"option":		self._parse_option,
+			"default":		self._parse_default,
+			"select":		self._parse_select,
+			"imply":		self._parse_select,
+			"visible":		self._parse_visible_if,
+			"if":			self._parse_conditional,
+		}
+
+	def _skip(self, text, pos):
+		return self._WHITESPACE_RE.match(text, pos).end()
+
+	def _symbol(self, text, pos):
+		result = self._SYMBOL_RE.match(text, pos)
+		if result is None:
+			raise _NoFastPath()
+		return (Symbol(result.group(0)), self._skip(text, result.end()))
+
+	def _quoted_string(self, text, pos):
+		regex = self._QUOTED_RE.get(text[pos : pos + 1])
+		if regex is None:
+			raise _NoFastPath()
+		result = regex.match(text, pos)
+		if result is None:
+			raise _NoFastPath()
+		# The grammar skips separators after the opening quote
+		return (Literal(result.group(1).lstrip()), self._skip(text, result.end()))
+
+	def _term(self, text, pos):
+		result = self._SYMBOL_RE.match(text, pos)
+		if result is not None:
+			value = result.group(0)
+			if value[0] in "ynm":
+				if len(value) != 1:
+					# Grammar would match a single tristate character here
+					raise _NoFastPath()
+				return (Literal(value), self._skip(text, result.end()))
+			return (Symbol(value), self._skip(text, result.end()))
+		return self._quoted_string(text, pos)
+
+	def _unary_expression(self, text, pos):
+		if text.startswith("$(", pos):
+			raise _NoFastPath()
+		if text.startswith("!", pos):
+			(rhs, pos) = self._unary_expression(text, self._skip(text, pos + 1))
+			return (Comparison(lhs = None, op = "!", rhs = rhs), pos)
+		return self._term(text, pos)
+
+	def _cmp_expression(self, text, pos):
+		(lhs, pos) = self._unary_expression(text, pos)
+		result = self._CMP_OP_RE.match(text, pos)
+		if result is None:
+			return (lhs, pos)
+		(rhs, pos) = self._unary_expression(text, self._skip(text, result.end()))
+		return (Comparison(lhs = lhs, op = result.group(0), rhs = rhs), pos)
+
+	def _and_expression(self, text, pos):
+		(lhs, pos) = self._cmp_expression(text, pos)
+		if not text.startswith("&&", pos):
+			return (lhs, pos)
+		(rhs, pos) = self._and_expression(text, self._skip(text, pos + 2))
+		return (Comparison(lhs = lhs, op = "&&", rhs = rhs), pos)
+
+	def _expression(self, text, pos):
+		# Same precedence and grouping as the grammar
+		(lhs, pos) = self._and_expression(text, pos)
+		if not text.startswith("||", pos):
+			return (lhs, pos)
+		(rhs, pos) = self._expression(text, self._skip(text, pos + 2))
+		return (Comparison(lhs = lhs, op = "||", rhs = rhs), pos)
+
+	def _optional_condition(self, text, pos):
+		result = self._IF_RE.match(text, pos)
+		if result is None:
+			return (None, pos)
+		return self._expression(text, self._skip(text, result.end()))
+
+	def _end(self, text, pos):
+		if text.startswith("#", pos):
+			return
+		if pos != len(text):
+			raise _NoFastPath()
+
+	def _parse_config(self, keyword, text, pos):
+		(symbol, pos) = self._symbol(text, pos)
+		self._end(text, pos)
+		return ConfigurationItem(conftype = keyword, symbol = symbol)
+
+	def _parse_menu(self, keyword, text, pos):
+		(string, pos) = self._quoted_string(text, pos)
+		self._end(text, pos)
+		return Menu(menutype = keyword, text = string)
+
+	def _parse_source(self, keyword, text, pos):
+		(string, pos) = self._quoted_string(text, pos)
+		self._end(text, pos)
+		return Source(filename = string)
+
+	def _parse_comment(self, keyword, text, pos):
+		(string, pos) = self._quoted_string(text, pos)
+		self._end(text, pos)
+		return Comment(text = string)
+
+	def _parse_type(self, keyword, text, pos):
+		if pos == len(text):
+			return ConfigType(typename = keyword, text = None, condition = None)
+		(string, pos) = self._quoted_string(text, pos)
+		(condition, pos) = self._optional_condition(text, pos)
+		self._end(text, pos)
+		return ConfigType(typename = keyword, text = string, condition = condition)
+
+	def _parse_deftype(self, keyword, text, pos):
+		(value, pos) = self._expression(text, pos)
+		(condition, pos) = self._optional_condition(text, pos)
+		self._end(text, pos)
+		return DefType(typename = keyword, value = value, condition = condition)
+
+	def _range_value(self, text, pos):
+		result = self._INTVAL_RE.match(text, pos)
+		if result is not None:
+			if (result.end() < len(text)) and (self._SYMBOL_RE.match(text, result.end()) is not None):
+				raise _NoFastPath()
+			return (_to_int(result.group(0)), self._skip(text, result.end()))
+		return self._symbol(text, pos)
+
+	def _parse_range(self, keyword, text, pos):
+		(fromvalue, pos) = self._range_value(text, pos)
+		(tovalue, pos) = self._range_value(text, pos)
+		(condition, pos) = self._optional_condition(text, pos)
+		self._end(text, pos)
+		return Range(fromvalue = fromvalue, tovalue = tovalue, condition = condition)
+
+	def _parse_depends_on(self, keyword, text, pos):
+		# Grammar token is literally "depends on", with a single space
+		if not text.startswith("depends on"):
+			raise _NoFastPath()
+		(dependency, pos) = self._expression(text, self._skip(text, len("depends on")))
+		self._end(text, pos)
+		return DependsOn(dependency = dependency)
+
+	def _parse_option(self, keyword, text, pos):
+		if text.startswith(("=", ":="), pos):
+			# Assignment to a variable called "option"
+			raise _NoFastPath()
+		return Option(parameters = text[pos : ])
+
+	def _parse_default(self, keyword, text, pos):
+		(value, pos) = self._expression(text, pos)
+		(condition, pos) = self._optional_condition(text, pos)
+		self._end(text, pos)
+		return DefaultValue(value = value, condition = condition)
+
+	def _parse_select(self, keyword, text, pos):
+		(symbol, pos) = self._symbol(text, pos)
+		(condition, pos) = self._optional_condition(text, pos)
+		self._end(text, pos)
+		if keyword == "select":
+			return Select(symbol = symbol, condition = condition)
+		else:
+			return Imply(symbol = symbol, condition = condition)
+
+	def _parse_visible_if(self, keyword, text, pos):
+		if not text.startswith("visible if"):
+			raise _NoFastPath()
+		(condition, pos) = self._expression(text, self._skip(text, len("visible if")))
+		self._end(text, pos)
+		return VisibleIf(condition = condition)
+
+	def _parse_conditional(self, keyword, text, pos):
+		(condition, pos) = self._expression(text, pos)
+		self._end(text, pos)
+		return Conditional(condition = condition)
+
+	def parse(self, keyword, line):
+		handler = self._dispatch.get(keyword)
+		if handler is None:
+			return None
+		text = line.lstrip()
+		pos = len(keyword)
+		if (pos < len(text)) and (not text[pos].isspace()):
+			return None
+		try:
+			return handler(keyword, text, self._skip(text, pos))
+		except _NoFastPath:
+			return None
+
+if __name__ == "__main__":
+	# Differential test: compare the fast path against the grammar for every
+	# line of every Kconfig file in a kernel tree.
+	import os
+	import sys
+	import tpg
+	from KConfigParser import KConfigParser
+
+	def canonical(obj):
+		if isinstance(obj, Symbol):
+			return ("Symbol", obj.name)
+		elif isinstance(obj, Literal):
+			return ("Literal", obj.value)
+		elif isinstance(obj, Comparison):
+			return ("Comparison", canonical(obj._lhs), obj._op, canonical(obj._rhs))
+		elif isinstance(obj, tuple):
+			return (obj.__class__.__name__, ) + tuple(canonical(element) for element in obj)
+		else:
+			return obj
+
+	if len(sys.argv) != 2:
+		print("%s [kernel_path]" % (sys.argv[0]))
+		sys.exit(1)
+
+	fastparser = KConfigFastParser()
+	configparser = KConfigParser()
+	(linecount, fastcount, mismatches) = (0, 0, 0)
+	for (basedir, dirs, filenames) in os.walk(sys.argv[1]):
+		for filename in filenames:
+			if not filename.startswith("Kconfig"):
+				continue
+			full_filename = os.path.join(basedir, filename)
+			with open(full_filename) as f:
+				for (lineno, line) in enumerate(f, 1):
+					line = line.rstrip("\r\n")
+					splitline = line.split(maxsplit = 1)
+					if len(splitline) == 0:
+						continue
+					linecount += 1
+					fast = fastparser.parse(splitline[0], line)
+					if fast is None:
+						continue
+					fastcount += 1
+					try:
+						slow = configparser.parse("ConfigurationItem", line)
+					except tpg.SyntacticError:
+						slow = None
+					if canonical(fast) != canonical(slow):
+						print("%s:%d: \"%s\"" % (full_filename, lineno, line))
+						print("    fast path: %s" % (str(canonical(fast))))
+						print("    grammar  : %s" % (str(canonical(slow))))
+						mismatches += 1
+	print("%d lines, %d handled by fast path, %d mismatches." % (linecount, fastcount, mismatches))
+	sys.exit(0 if (mismatches == 0) else 1)
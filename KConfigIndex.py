@@ -0,0 +1,248 @@
+#	searchkconfig - Search Linux kernel KConfig files.
+#	Copyright (C) 2017-2017 Johannes Bauer
+#
+#	This file is part of searchkconfig.
+#
+#	searchkconfig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	searchkconfig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with searchkconfig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+#
+
+import re
+import collections
+import array
+import _sre
+try:
+	import re._parser as sre_parse
+	from re._compiler import _EXTRA_CASES as _sre_extra_cases
+except ImportError:
+	import sre_parse
+	from sre_compile import _ignorecase_fixes as _sre_extra_cases
+
+class _CaseFoldTable(dict):
+	# Translation table that maps every character to one representative of
+	# the characters re.IGNORECASE treats as equal to it. Like the regex
+	# engine, this uses simple lowercasing plus a few extra equivalences
+	# (e.g., i and dotless i), so it never changes the length of a string.
+	# Entries are computed on first use.
+	def __missing__(self, char):
+		lower = _sre.unicode_tolower(char)
+		folded = min((lower, ) + _sre_extra_cases.get(lower, ( )))
+		self[char] = folded
+		return folded
+
+_CASE_FOLD_TABLE = _CaseFoldTable()
+
+class KConfigIndex(object):
+	# Inverted index over symbol names, prompts and help texts of all nodes
+	# of a parsed tree. A search regex is analyzed for literal strings that
+	# any match must contain; these are looked up in a word index (for
+	# literals enclosed in \b) or a trigram index, and only the surviving
+	# candidate nodes are checked with the full regex. The index references
+	# the ConfigItems themselves, so it is pickled together with the tree.
+	#
+	# Posting lists are stored as sorted arrays of node IDs or, if they
+	# contain more than one in 32 of all nodes, as bitmaps. Both pickle as
+	# flat byte strings and load much faster than sets of integers.
+	_WORD_RE = re.compile(r"\w+")
+	_REPEAT_OPS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", sre_parse.MAX_REPEAT))
+
+	def __init__(self, rootnode):
+		self._nodes = [ ]
+		self._words = collections.defaultdict(set)
+		self._trigrams = collections.defaultdict(set)
+		self._build(rootnode)
+		self._words = { key: self._encode_postings(node_ids) for (key, node_ids) in self._words.items() }
+		self._trigrams = { key: self._encode_postings(node_ids) for (key, node_ids) in self._trigrams.items() }
+
+	@staticmethod
+	def normalize(text):
+		# casefold() is not suitable, it maps the dotted capital I to two
+		# characters and leaves the dotless i alone, whereas the regex
+		# engine treats both as equal to i. All characters equal to an ASCII
+		# letter under re.IGNORECASE fold to that letter.
+		if text.isascii():
+			return text.lower()
+		return text.translate(_CASE_FOLD_TABLE)
+
+	@staticmethod
+	def _node_texts(node):
+		yield node.symbol.name
+		if node.text is not None:
+			yield node.text.value
+		if node.helptext is not None:
+			yield node.helptext
+
+	def _build(self, rootnode):
+		# Only nodes with a symbol can ever match a search
+		stack = [ rootnode ]
+		while len(stack) > 0:
+			node = stack.pop()
+			stack += reversed(node.children)
+			if node.symbol is None:
+				continue
+			node_id = len(self._nodes)
+			self._nodes.append(node)
+			for text in self._node_texts(node):
+				# Words are split before normalizing, since folding may change
+				# whether a character counts as a word character
+				for word in self._WORD_RE.findall(text):
+					self._words[self.normalize(word)].add(node_id)
+				text = self.normalize(text)
+				for i in range(len(text) - 2):
+					self._trigrams[text[i : i + 3]].add(node_id)
+
+	def __len__(self):
+		return len(self._nodes)
+
+	def _encode_postings(self, node_ids):
+		if len(node_ids) * 32 < len(self._nodes):
+			return array.array("I", sorted(node_ids))
+		bitmap = bytearray((len(self._nodes) + 7) // 8)
+		for node_id in node_ids:
+			bitmap[node_id >> 3] |= 1 << (node_id & 7)
+		return bytes(bitmap)
+
+	@staticmethod
+	def _decode_postings(postings):
+		if postings is None:
+			return set()
+		elif isinstance(postings, array.array):
+			return set(postings)
+		else:
+			bits = bin(int.from_bytes(postings, "little"))[ : 1 : -1]
+			return set(node_id for (node_id, bit) in enumerate(bits) if bit == "1")
+
+	@classmethod
+	def _requirements(cls, subpattern):
+		# Returns a query tree of ("and", [ ... ]), ("or", [ ... ]),
+		# ("literal", text) and ("word", text) nodes that every string
+		# matching the subpattern must satisfy.
+		requirements = [ ]
+		run = ""
+		run_bounded = False
+		after_boundary = False
+		for (op, av) in subpattern:
+			if op is sre_parse.LITERAL:
+				if run == "":
+					run_bounded = after_boundary
+				run += chr(av)
+				after_boundary = False
+				continue
+
+			is_boundary = (op is sre_parse.AT) and (av is sre_parse.AT_BOUNDARY)
+			if is_boundary and run_bounded and (cls._WORD_RE.fullmatch(run) is not None):
+				requirements.append(("word", run))
+				run = ""
+			after_boundary = is_boundary
+
+			if run != "":
+				requirements.append(("literal", run))
+				run = ""
+
+			if op is sre_parse.SUBPATTERN:
+				requirements.append(cls._requirements(av[-1]))
+			elif (op in cls._REPEAT_OPS) and (av[0] >= 1):
+				requirements.append(cls._requirements(av[2]))
+			elif op is sre_parse.BRANCH:
+				requirements.append(("or", [ cls._requirements(branch) for branch in av[1] ]))
+		if run != "":
+			requirements.append(("literal", run))
+		return ("and", requirements)
+
+	def _lookup(self, requirement):
+		# Returns a set of candidate node IDs or None if unrestricted
+		(reqtype, value) = requirement
+		if reqtype == "and":
+			result = None
+			for subrequirement in value:
+				candidates = self._lookup(subrequirement)
+				if candidates is None:
+					continue
+				if result is None:
+					result = candidates
+				else:
+					result = result & candidates
+			return result
+		elif reqtype == "or":
+			result = set()
+			for subrequirement in value:
+				candidates = self._lookup(subrequirement)
+				if candidates is None:
+					return None
+				result |= candidates
+			return result
+		elif reqtype == "word":
+			return self._decode_postings(self._words.get(self.normalize(value)))
+		else:
+			value = self.normalize(value)
+			if len(value) < 3:
+				return None
+			trigrams = [ self._trigrams.get(value[i : i + 3]) for i in range(len(value) - 2) ]
+			if any(postings is None for postings in trigrams):
+				return set()
+
+			# Start with the shortest posting list, bitmaps are only probed
+			trigrams.sort(key = lambda postings: (isinstance(postings, bytes), len(postings)))
+			result = self._decode_postings(trigrams[0])
+			for postings in trigrams[1:]:
+				if len(result) == 0:
+					break
+				if isinstance(postings, bytes):
+					result = set(node_id for node_id in result if postings[node_id >> 3] & (1 << (node_id & 7)))
+				else:
+					result.intersection_update(postings)
+			return result
+
+	@classmethod
+	def _required_strings(cls, requirement):
+		(reqtype, value) = requirement
+		if reqtype == "and":
+			for subrequirement in value:
+				yield from cls._required_strings(subrequirement)
+		elif reqtype in [ "literal", "word" ]:
+			yield cls.normalize(value)
+
+	@classmethod
+	def required_literals(cls, regex):
+		# Normalized strings that are contained in every match of regex,
+		# usable as a substring prefilter without having an index at hand
+		try:
+			parsed = sre_parse.parse(regex.pattern, regex.flags)
+		except Exception:
+			return [ ]
+		return sorted(set(cls._required_strings(cls._requirements(parsed))), key = len, reverse = True)
+
+	def candidates(self, regex):
+		# Superset of the nodes that can match regex, in tree order, or None
+		# if the regex contains no literals that narrow down the search.
+		try:
+			parsed = sre_parse.parse(regex.pattern, regex.flags)
+		except Exception:
+			return None
+		candidates = self._lookup(self._requirements(parsed))
+		if candidates is None:
+			return None
+		return [ self._nodes[node_id] for node_id in sorted(candidates) ]
+
+	def search(self, search_spec):
+		nodes = None
+		if search_spec.regex is not None:
+			nodes = self.candidates(search_spec.regex)
+		if nodes is None:
+			nodes = self._nodes
+		for node in nodes:
+			if node.matches(search_spec):
+				yield node
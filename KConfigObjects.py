@@ -40,11 +40,55 @@ Conditional = collections.namedtuple("Conditional", [ "condition" ])
 Comparison = collections.namedtuple("Comparison", [ "lhs", "op", "rhs" ])
 ConfigurationItem = collections.namedtuple("ConfigurationItem", [ "conftype", "symbol" ])
 Assignment = collections.namedtuple("Assignment", [ "lhs", "rhs" ])
-ExecutionExpression = collections.namedtuple("ExecutionExpression", [ "value" ])
+Keyword = collections.namedtuple("Keyword", [ "keyword" ])
+HelpText = collections.namedtuple("HelpText", [ "text" ])
 
+class ExecutionExpression(collections.namedtuple("ExecutionExpression", [ "value" ])):
+	# $(...) invocation within an expression, e.g., $(cc-option,...). It is
+	# kept as written and never executed.
+	__slots__ = ( )
+
+	def format(self, kconfig = None):
+		return "$(%s)" % (self.value)
+
+	def __str__(self):
+		return self.format()
+
+_NO_SYMBOLS = frozenset()
+
+def required_symbols(expr):
+	# Set of symbols that must be enabled for expr to hold, i.e., the ones
+	# that are required by all operands of an "||" or any operand of an "&&".
+	# Other expressions (e.g., $(shell ...) invocations) require nothing.
+	return getattr(expr, "required_symbols", _NO_SYMBOLS)
+
+# Expression objects are hash-consed: constructing a Symbol, Literal or
+# Comparison that is structurally equal to an existing one returns the
+# existing instance. Expressions therefore form a DAG in which equal
+# subexpressions are shared, and equality and hashing are by identity.
+# Unpickling goes through __new__ as well (see __getnewargs__), so objects
+# loaded from the cache or returned by worker processes are re-interned;
+# their state is completely given by those arguments, so none is pickled.
+# Since nodes are shared, the set of required symbols is precomputed once
+# per node when it is created.
 class Literal(object):
-	def __init__(self, value):
-		self._value = value
+	__slots__ = ( "_value", )
+	_interned = { }
+	required_symbols = _NO_SYMBOLS
+
+	def __new__(cls, value):
+		instance = cls._interned.get(value)
+		if instance is None:
+			instance = object.__new__(cls)
+			instance._value = value
+			cls._interned[value] = instance
+		return instance
+
+	def __getnewargs__(self):
+		return (self._value, )
+
+	def __getstate__(self):
+		return None
 
 	@property
 	def value(self):
@@ -53,27 +97,68 @@ class Literal(object):
 	def requires(self, symbol):
 		return False
 
+	def format(self, kconfig = None):
+		return self.value
+
 	def __str__(self):
 		return self.value
 
 class Symbol(object):
-	def __init__(self, name):
-		self._name = name
+	# The interning table doubles as global symbol registry: every symbol
+	# also gets a dense integer ID, so that per-symbol data can be kept in
+	# arrays indexed by ID. IDs are assigned in order of first appearance and
+	# only valid within one process, they are never pickled. The ID is a
+	# plain attribute instead of a property since it is read in hot paths.
+	__slots__ = ( "_name", "id", "_required_symbols" )
+	_interned = { }
+	_by_id = [ ]
+
+	def __new__(cls, name):
+		instance = cls._interned.get(name)
+		if instance is None:
+			instance = object.__new__(cls)
+			instance._name = name
+			instance.id = len(cls._by_id)
+			instance._required_symbols = frozenset((instance, ))
+			cls._interned[name] = instance
+			cls._by_id.append(instance)
+		return instance
+
+	@classmethod
+	def lookup(cls, name):
+		# Like the constructor, but does not register unknown names
+		return cls._interned.get(name)
+
+	@classmethod
+	def names(cls):
+		# All registered names, indexed by symbol ID
+		return [ symbol.name for symbol in cls._by_id ]
+
+	def __getnewargs__(self):
+		return (self._name, )
+
+	def __getstate__(self):
+		return None
 
 	@property
 	def name(self):
 		return self._name
 
+	@property
+	def required_symbols(self):
+		return self._required_symbols
+
 	def requires(self, symbol):
-		return symbol == self
+		return symbol is self
+
+	_STATE_COLORS = {
+		ConfigOptionState.Enabled:	"green",
+		ConfigOptionState.Disabled:	"red",
+		ConfigOptionState.Module:	"cyan",
+	}
 
 	def _get_color(self, kconfig):
-		value = kconfig[self.name]
-		return {
-			ConfigOptionState.Enabled:	"green",
-			ConfigOptionState.Disabled:	"red",
-			ConfigOptionState.Module:	"cyan",
-		}.get(value, "gray")
+		return self._STATE_COLORS.get(kconfig.state(self), "gray")
 
 	def get_colorizer(self, kconfig):
 		if kconfig is None:
@@ -91,34 +176,59 @@ class Symbol(object):
 	def _cmpkey(self):
 		return ("symbol", self.name)
 
-	def __eq__(self, other):
-		return (self.__class__ == other.__class__) and (self._cmpkey() == other._cmpkey())
-
 	def __lt__(self, other):
 		return (self.__class__ == other.__class__) and (self._cmpkey() < other._cmpkey())
 
-	def __neq__(self, other):
-		return not (self == other)
-
-	def __hash__(self):
-		return hash(self._cmpkey())
-
 	def __repr__(self):
 		return self._name
 
 class Comparison(object):
-	def __init__(self, lhs, op, rhs):
-		self._lhs = lhs
-		self._op = op
-		self._rhs = rhs
+	__slots__ = ( "_lhs", "_op", "_rhs", "_required_symbols" )
+
+	# Operands are interned already, so they are keyed by identity
+	_interned = { }
+
+	def __new__(cls, lhs, op, rhs):
+		key = (id(lhs), op, id(rhs))
+		instance = cls._interned.get(key)
+		if instance is None:
+			instance = object.__new__(cls)
+			instance._lhs = lhs
+			instance._op = op
+			instance._rhs = rhs
+			if op == "&&":
+				instance._required_symbols = required_symbols(lhs) | required_symbols(rhs)
+			elif op == "||":
+				instance._required_symbols = required_symbols(lhs) & required_symbols(rhs)
+			else:
+				instance._required_symbols = _NO_SYMBOLS
+			cls._interned[key] = instance
+		return instance
+
+	def __getnewargs__(self):
+		return (self._lhs, self._op, self._rhs)
+
+	def __getstate__(self):
+		return None
+
+	@property
+	def lhs(self):
+		return self._lhs
+
+	@property
+	def op(self):
+		return self._op
+
+	@property
+	def rhs(self):
+		return self._rhs
+
+	@property
+	def required_symbols(self):
+		return self._required_symbols
 
 	def requires(self, symbol):
-		if self._op == "&&":
-			return self._lhs.requires(symbol) or self._rhs.requires(symbol)
-		elif self._op == "||":
-			return self._lhs.requires(symbol) and self._rhs.requires(symbol)
-		else:
-			return False
+		return symbol in self._required_symbols
 
 	def format(self, kconfig = None):
 		if self._lhs is None:
@@ -132,3 +242,60 @@ class Comparison(object):
 		else:
 			return "(%s %s %s)" % (self._lhs, self._op, self._rhs)
 
+
+class SymbolTable(object):
+	# Maps symbols to values through a list indexed by symbol ID, values must
+	# not be None. Like a defaultdict, a missing value is created by
+	# default_factory on item access. Since symbol IDs are only valid within
+	# one process, tables are pickled as (symbol, value) pairs and re-indexed
+	# by the IDs of the re-interned symbols when loaded.
+	__slots__ = ( "_values", "_default_factory" )
+
+	def __init__(self, default_factory = None):
+		self._values = [ ]
+		self._default_factory = default_factory
+
+	def get(self, symbol, default = None):
+		if symbol.id < len(self._values):
+			value = self._values[symbol.id]
+			if value is not None:
+				return value
+		return default
+
+	def __getitem__(self, symbol):
+		value = self.get(symbol)
+		if value is None:
+			if self._default_factory is None:
+				raise KeyError(symbol)
+			value = self._default_factory()
+			self[symbol] = value
+		return value
+
+	def __setitem__(self, symbol, value):
+		if symbol.id >= len(self._values):
+			self._values += [ None ] * (symbol.id + 1 - len(self._values))
+		self._values[symbol.id] = value
+
+	def __contains__(self, symbol):
+		return self.get(symbol) is not None
+
+	def items(self):
+		for (symbol_id, value) in enumerate(self._values):
+			if value is not None:
+				yield (Symbol._by_id[symbol_id], value)
+
+	def __iter__(self):
+		for (symbol, value) in self.items():
+			yield symbol
+
+	def __len__(self):
+		return sum(1 for value in self._values if value is not None)
+
+	def __getstate__(self):
+		return (self._default_factory, list(self.items()))
+
+	def __setstate__(self, state):
+		(self._default_factory, items) = state
+		self._values = [ ]
+		for (symbol, value) in items:
+			self[symbol] = value
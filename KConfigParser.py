@@ -20,6 +20,10 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 #
 
+import os
+import sys
+import hashlib
+import marshal
 import tpg
 from KConfigObjects import Symbol, Source, ConfigurationItem, Menu, ConfigType, Option, Comparison, DefaultValue, DependsOn, Select, DefType, Conditional, Range, Comment, Imply, VisibleIf, Literal, Assignment, ExecutionExpression
 
@@ -29,8 +33,7 @@ def _to_int(value):
 	else:
 		return int(value)
 
-class KConfigParser(tpg.VerboseParser):
-	r"""
+_GRAMMAR = r"""
 		set lexer = ContextSensitiveLexer
 		separator space			'\s+';
 
@@ -57,7 +60,9 @@ class KConfigParser(tpg.VerboseParser):
 		token kw_endchoice		"endchoice";
 
 		token assign_op			':=';
-		token cmp_op			'=|!=|&&|\|\||>=|<=|>|<';
+		token cmp_op			'=|!=|>=|<=|>|<';
+		token and_op			'&&';
+		token or_op				'\|\|';
 		token unary_op			'!';
 		token comment			'#[^\n]*';
 		token symbol			'[-A-Za-z0-9_]+'		$ Symbol
@@ -113,11 +118,27 @@ class KConfigParser(tpg.VerboseParser):
 			symbol/symbol (kw_if Expression/condition)?
 		;
 
+		# Kconfig precedence, from strongest to weakest: "!", comparisons,
+		# "&&", "||". Chains of "&&" or "||" are grouped to the right.
 		Expression/e ->
+			AndExpression/e (or_op/op Expression/rhs								$ e = Comparison(lhs = e, op = op, rhs = rhs)
+			)?
+		;
+
+		AndExpression/e ->
+			CmpExpression/e (and_op/op AndExpression/rhs							$ e = Comparison(lhs = e, op = op, rhs = rhs)
+			)?
+		;
+
+		CmpExpression/e ->
+			UnaryExpression/e (cmp_op/op UnaryExpression/rhs						$ e = Comparison(lhs = e, op = op, rhs = rhs)
+			)?
+		;
+
+		UnaryExpression/e ->
 			(
 				'\$\(' Substitution/e+ '\)'												$ e = ExecutionExpression(e)
-				| unary_op/op Expression/e												$ e = Comparison(lhs = None, op = op, rhs = e)
-				| Term/lhs cmp_op/op Expression/rhs										$ e = Comparison(lhs = lhs, op = op, rhs = rhs)
+				| unary_op/op UnaryExpression/e											$ e = Comparison(lhs = None, op = op, rhs = e)
 				| Term/e
 			)
 		;
@@ -132,11 +153,50 @@ class KConfigParser(tpg.VerboseParser):
 		;
 
 		"""
-	verbose = 0
 
-if __name__ == "__main__":
-	KConfigParser.verbose = 2
+def _compile_grammar():
+	# Translating the grammar into Python code through TPG is expensive, so
+	# the compiled code object is cached in __pycache__ next to this module,
+	# keyed by grammar text, TPG version and Python version.
+	key = hashlib.sha256(("%s\0%s" % (tpg.__version__, _GRAMMAR)).encode()).hexdigest()
+	cachedir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+	cachefile = os.path.join(cachedir, "KConfigParser.grammar.%s.%s.bin" % (sys.implementation.cache_tag, key[:32]))
+	try:
+		with open(cachefile, "rb") as f:
+			return marshal.load(f)
+	except (OSError, EOFError, ValueError, TypeError):
+		pass
+
+	sources = [ source for (attribute, source, code) in tpg.TPGParser(globals())(_GRAMMAR) ]
+	code = compile("\n".join(sources), "<KConfigParser grammar>", "exec")
+	try:
+		os.makedirs(cachedir, exist_ok = True)
+		tmpfile = "%s.%d.tmp" % (cachefile, os.getpid())
+		with open(tmpfile, "wb") as f:
+			marshal.dump(code, f)
+		os.replace(tmpfile, cachefile)
+	except OSError:
+		# Read-only installation, simply do not cache
+		pass
+	return code
+
+def _generated_rules():
+	rules = { }
+	exec(_compile_grammar(), globals(), rules)
+	return rules
+
+class KConfigParser(tpg.Parser):
+	pass
+
+class KConfigVerboseParser(tpg.VerboseParser):
+	# Only for debugging, tracing every token match is very slow
+	verbose = 2
+
+for (_name, _rule) in _generated_rules().items():
+	setattr(KConfigParser, _name, _rule)
+	setattr(KConfigVerboseParser, _name, _rule)
 
+if __name__ == "__main__":
 	def show_error(text, line, column):
 		ctx = 2
 		text = text.split("\n")
@@ -149,7 +209,7 @@ if __name__ == "__main__":
 
 	def try_parse(text, filename = None):
 		print("-" * 120)
-		parser = KConfigParser()
+		parser = KConfigVerboseParser()
 		try:
 			parsed = parser(text)
 		except tpg.SyntacticError as e:
@@ -22,15 +22,21 @@
 
 import os
 import re
+import json
 import collections
 import tpg
 import enum
 import sys
+import concurrent.futures
 
 import Tools
 from KConfigParser import KConfigParser
-from KConfigObjects import Symbol, Source, ConfigurationItem, Menu, ConfigType, Option, DefaultValue, DependsOn, Select, DefType, Conditional, Range, Comment, Imply, VisibleIf, Assignment
+from KConfigFastParser import KConfigFastParser
+from KConfigObjects import required_symbols, Symbol, SymbolTable, Source, ConfigurationItem, Menu, ConfigType, Option, DefaultValue, DependsOn, Select, DefType, Conditional, Range, Comment, Imply, VisibleIf, Assignment, Keyword, HelpText
 from KernelConfiguration import KernelConfiguration, ConfigOptionState
+from KConfigCache import KConfigCache, FileFingerprint
+from KConfigIndex import KConfigIndex
+from KConfigEvaluator import KConfigEvaluator
 
 class ItemType(enum.IntEnum):
 	RootMenu = 0
@@ -39,9 +45,39 @@ class ItemType(enum.IntEnum):
 	MenuConfig = 3
 	Choice = 4
 
+# Entry of the reverse dependency index: item selects or implies (depending
+# on kind) the indexed symbol, optionally only if condition holds
+ReverseDependency = collections.namedtuple("ReverseDependency", [ "kind", "item", "condition" ])
+
+class ConditionFrame(collections.namedtuple("ConditionFrame", [ "condition", "parent", "required_symbols" ])):
+	# Condition of one "if" block, linked to the frame of the enclosing
+	# block. Frames are immutable and shared by all items inside the block,
+	# so creating an item does not copy the conditions of its surroundings.
+	# required_symbols accumulates those of all enclosing conditions.
+	__slots__ = ( )
+
+	@classmethod
+	def push(cls, parent, condition):
+		symbols = required_symbols(condition)
+		if parent is not None:
+			symbols = symbols | parent.required_symbols
+		return cls(condition = condition, parent = parent, required_symbols = symbols)
+
+	def conditions(self):
+		# Outermost condition first
+		result = [ ]
+		frame = self
+		while frame is not None:
+			result.append(frame.condition)
+			frame = frame.parent
+		result.reverse()
+		return result
+
 class ConfigItem(object):
+	# A full tree has tens of thousands of items, do without per-instance dicts
+	__slots__ = ( "_itemtype", "_parent", "_text", "_symbol", "_origin_filename", "_origin_lineno", "_helptext", "_search_corpus", "_properties", "_children", "_visible", "_enclosing_conditions", "_conditions", "_required_symbols" )
 	_KEY_ABBREVIATION_RE = re.compile("([abcdefghijklopqrstuvwxz])", re.IGNORECASE)
-	def __init__(self, itemtype, parent = None, text = None, symbol = None, filename = None, lineno = None, conditions = None):
+	def __init__(self, itemtype, parent = None, text = None, symbol = None, filename = None, lineno = None, enclosing_conditions = None):
 		self._itemtype = itemtype
 		self._parent = parent
 		self._text = text
@@ -49,11 +85,21 @@ class ConfigItem(object):
 		self._origin_filename = filename
 		self._origin_lineno = lineno
 		self._helptext = None
+		self._search_corpus = None
+		self._properties = None
 		self._children = [ ]
 		self._visible = False
-		self._conditions = [ ]
-		if conditions is not None:
-			self.append_all_conditions(conditions)
+		# ConditionFrame of the enclosing "if" blocks (or None) and the list
+		# of the item's own "depends on" and "visible if" clauses (or None)
+		self._enclosing_conditions = enclosing_conditions
+		self._conditions = None
+		# Symbols required by all of the above, these decide which items
+		# create_submenus() moves below a menuconfig
+		if enclosing_conditions is None:
+			self._required_symbols = frozenset()
+		else:
+			self._required_symbols = enclosing_conditions.required_symbols
+		self._update_search_corpus()
 
 	@property
 	def abbreviation_key(self):
@@ -74,10 +120,16 @@ class ConfigItem(object):
 		self._visible = value
 
 	def set_visible(self):
+		# All ancestors of a visible node are visible as well, so marking can
+		# stop at the first one that already is
 		node = self
-		while node is not None:
-			node.visible = True
-			node = node.parent
+		while (node is not None) and (not node._visible):
+			node._visible = True
+			node = node._parent
+
+	def reset_visibility(self):
+		for (depth, node) in self.walk(filter = lambda node: node._visible):
+			node._visible = False
 
 	@property
 	def itemtype(self):
@@ -95,23 +147,98 @@ class ConfigItem(object):
 	def text(self, value):
 		assert(value is not None)
 		self._text = value
+		self._update_search_corpus()
 
 	@property
 	def symbol(self):
 		return self._symbol
 
-	def append_condition(self, condition):
-		self._conditions.append(condition)
+	@property
+	def children(self):
+		return self._children
 
-	def append_all_conditions(self, conditions):
-		self._conditions += conditions
+	@property
+	def helptext(self):
+		return self._helptext
+
+	def add_property(self, prop):
+		# Select, Imply, DefaultValue, DefType and Range entries. Most items
+		# have few or none of them, so the list is only created on demand.
+		if self._properties is None:
+			self._properties = [ prop ]
+		else:
+			self._properties.append(prop)
+
+	def _properties_of_type(self, *proptypes):
+		if self._properties is None:
+			return [ ]
+		return [ prop for prop in self._properties if isinstance(prop, proptypes) ]
+
+	@property
+	def selects(self):
+		return self._properties_of_type(Select)
+
+	@property
+	def implies(self):
+		return self._properties_of_type(Imply)
+
+	@property
+	def defaults(self):
+		# "def_bool" and "def_tristate" are defaults as well
+		return self._properties_of_type(DefaultValue, DefType)
+
+	@property
+	def ranges(self):
+		return self._properties_of_type(Range)
+
+	@property
+	def conditions(self):
+		if self._enclosing_conditions is None:
+			result = [ ]
+		else:
+			result = self._enclosing_conditions.conditions()
+		if self._conditions is not None:
+			result += self._conditions
+		return result
+
+	@property
+	def required_symbols(self):
+		return self._required_symbols
+
+	def append_condition(self, condition):
+		if self._conditions is None:
+			self._conditions = [ condition ]
+		else:
+			self._conditions.append(condition)
+		symbols = required_symbols(condition)
+		if len(symbols) > 0:
+			self._required_symbols = self._required_symbols | symbols
 
 	def add_helptext_line(self, line):
+		# Help text is kept joined so that searching does not have to join
+		# it over and over again for every query
 		line = line.strip()
 		if self._helptext is None:
-			self._helptext = [ line ]
+			self._helptext = line
 		else:
-			self._helptext.append(line)
+			self._helptext += "\n" + line
+		if self._search_corpus is not None:
+			# Help text is the last field of the corpus
+			self._search_corpus += "\n" + KConfigIndex.normalize(line)
+
+	def _update_search_corpus(self):
+		# Normalized concatenation of all searchable fields. Every match of
+		# a regex contains its required literals, which are normalized the
+		# same way, so a node whose corpus lacks any of them is rejected by
+		# a cheap substring test before the regex itself is run.
+		if self.symbol is None:
+			return
+		fields = [ self.symbol.name ]
+		if self.text is not None:
+			fields.append(self.text.value)
+		if self._helptext is not None:
+			fields.append(self._helptext)
+		self._search_corpus = KConfigIndex.normalize("\n".join(fields))
 
 	def matches(self, search_spec):
 		if self.symbol is None:
@@ -121,69 +248,196 @@ class ConfigItem(object):
 			return False
 
 		if search_spec.regex is not None:
-			result = None
-			result = result or search_spec.regex.search(self.symbol.name)
-			if self.text is not None:
-				result = result or search_spec.regex.search(self.text.value)
-			return result is not None
+			for literal in search_spec.literals:
+				if literal not in self._search_corpus:
+					return False
+			for field in search_spec.fields:
+				if field == "name":
+					text = self._symbol.name
+				elif field == "prompt":
+					text = None if (self._text is None) else self._text.value
+				else:
+					text = self._helptext
+				if (text is not None) and (search_spec.regex.search(text) is not None):
+					return True
+			return False
 		else:
 			return True
 
+	def walk(self, order = "pre", filter = None):
+		# Iterative depth-first traversal yielding (depth, node) tuples, with
+		# the depth relative to this node. Subtrees whose root is rejected by
+		# filter are skipped entirely. In pre-order, the children of a node
+		# are only looked at after the node has been yielded, so the caller
+		# may still rearrange them.
+		if (filter is not None) and (not filter(self)):
+			return
+		if order == "pre":
+			stack = [ (0, self) ]
+			while len(stack) > 0:
+				(depth, node) = stack.pop()
+				yield (depth, node)
+				for child in reversed(node._children):
+					if (filter is None) or filter(child):
+						stack.append((depth + 1, child))
+		elif order == "post":
+			stack = [ (0, self, False) ]
+			while len(stack) > 0:
+				(depth, node, expanded) = stack.pop()
+				if expanded:
+					yield (depth, node)
+					continue
+				stack.append((depth, node, True))
+				for child in reversed(node._children):
+					if (filter is None) or filter(child):
+						stack.append((depth + 1, child, False))
+		else:
+			raise Exception("Unknown traversal order: %s" % (order))
+
 	def searchlist(self, search_spec):
-		if self.matches(search_spec):
-			yield self
-		for child in self._children:
-			yield from child.searchlist(search_spec)
+		for (depth, node) in self.walk():
+			if node.matches(search_spec):
+				yield node
 
-	def enable_visibility(self, search_spec):
+	def enable_visibility(self, search_spec, index = None):
+		if index is None:
+			leafnodes = self.searchlist(search_spec)
+		else:
+			leafnodes = index.search(search_spec)
 		count = 0
-		for leafnode in self.searchlist(search_spec):
+		for leafnode in leafnodes:
 			leafnode.set_visible()
 			count += 1
 		return count
 
 	@property
 	def have_help(self):
-		return (self._helptext is not None) and (len(Tools.striplist(self._helptext)) > 0)
+		return (self._helptext is not None) and (self._helptext.strip("\n") != "")
 
 	def format_help(self, prefix = ""):
-		helptext = Tools.striplist(self._helptext)
-		return prefix + ("\n" + prefix).join(helptext)
+		# Lines are stripped, so this drops leading and trailing empty lines
+		helptext = self._helptext.strip("\n")
+		return prefix + helptext.replace("\n", "\n" + prefix)
+
+	@property
+	def unnamed_label(self):
+		# Stands in for items that have neither prompt nor symbol, such as a
+		# choice without a prompt
+		return "<%s>" % (self._itemtype.name.lower())
 
 	def format(self, dump_spec = None):
-		if self.text is None:
-			text = self.symbol
+		# Always build a str, text and symbol are Literal and Symbol objects
+		if self._text is None:
+			text = self.unnamed_label if (self._symbol is None) else self._symbol.name
+		elif self._symbol is not None:
+			text = "%s (%s)" % (self._text, self._symbol.name)
 		else:
-			if self.symbol is not None:
-				text = "%s (%s)" % (self.text, self.symbol)
-			else:
-				text = self.text
+			text = str(self._text)
+		if dump_spec is None:
+			return text
 
-		if self.symbol is not None:
-			text = self.symbol.get_colorizer(dump_spec.kconfig)(text)
+		if (self._symbol is not None) and (dump_spec.kconfig is not None):
+			text = self._symbol.get_colorizer(dump_spec.kconfig)(text)
 
-		if (dump_spec is not None) and (dump_spec.show_key):
+		if dump_spec.show_key:
 			key = self.abbreviation_key
 			if key is not None:
 				text = "(%s) %s" % (key, text)
 
-		if (dump_spec is not None) and (dump_spec.show_origin):
+		if dump_spec.show_origin:
 			text += " {%s:%d}" % (self._origin_filename, self._origin_lineno)
-		if (dump_spec is not None) and (dump_spec.show_conditions):
-			if len(self._conditions) > 0:
-				text += " if "
-				text += " and ".join(condition.format(dump_spec.kconfig) for condition in self._conditions)
+		conditions = self.conditions if dump_spec.show_conditions else [ ]
+		if len(conditions) > 0:
+			text += " if " + " and ".join(condition.format(dump_spec.kconfig) for condition in conditions)
+			if dump_spec.evaluator is not None:
+				blocking_clauses = self.blocking_clauses(dump_spec.evaluator)
+				if len(blocking_clauses) > 0:
+					text += " [blocked by %s]" % (", ".join(clause.format(dump_spec.kconfig) for clause in blocking_clauses))
+		if (dump_spec.reverse_dependencies is not None) and (self._symbol is not None):
+			text += self._format_reverse_dependencies(dump_spec.reverse_dependencies.get(self._symbol, [ ]), dump_spec.kconfig)
 		return text
 
-	def dump(self, dump_spec = None, indent = 0):
-		if not self.visible:
-			return
-		indent_str = "    " * indent
-		print("%s%s" % (indent_str, self.format(dump_spec)))
-		if (dump_spec is not None) and (dump_spec.show_help) and self.have_help:
-			print(self.format_help(indent_str + "    "))
-		for child in self._children:
-			child.dump(dump_spec, indent + 1)
+	def blocking_clauses(self, evaluator):
+		# Parts of the conditions that evaluate to n under the configuration
+		clauses = [ ]
+		for condition in self.conditions:
+			clause = evaluator.blocking_clause(condition)
+			if clause is not None:
+				clauses.append(clause)
+		return clauses
+
+	@staticmethod
+	def _format_reverse_dependencies(reverse_dependencies, kconfig):
+		parts = [ ]
+		for kind in [ "select", "imply" ]:
+			selectors = [ ]
+			for reverse_dependency in reverse_dependencies:
+				if reverse_dependency.kind != kind:
+					continue
+				selector = reverse_dependency.item.symbol.format(kconfig)
+				if reverse_dependency.condition is not None:
+					selector += " if " + reverse_dependency.condition.format(kconfig)
+				selectors.append(selector)
+			if len(selectors) > 0:
+				parts.append("%s by %s" % ("selected" if (kind == "select") else "implied", ", ".join(selectors)))
+		if len(parts) == 0:
+			return ""
+		return " [%s]" % ("; ".join(parts))
+
+	def dump(self, dump_spec = None, indent = 0, writer = None):
+		# Writes to any object with a write() method, which should be
+		# buffered since every node results in at least one write
+		if writer is None:
+			writer = sys.stdout
+		write = writer.write
+		show_help = (dump_spec is not None) and dump_spec.show_help
+		for (depth, node) in self.walk(filter = lambda node: node._visible):
+			indent_str = "    " * (indent + depth)
+			write("%s%s\n" % (indent_str, node.format(dump_spec)))
+			if show_help and node.have_help:
+				write("%s\n" % (node.format_help(indent_str + "    ")))
+
+	@staticmethod
+	def _condition_record(condition):
+		return None if (condition is None) else str(condition)
+
+	def _record(self, menu, reverse_dependencies, evaluator):
+		record = {
+			"type":			self.itemtype.name,
+			"symbol":		None if (self._symbol is None) else self._symbol.name,
+			"prompt":		None if (self._text is None) else str(self._text),
+			"menu":			menu,
+			"file":			self._origin_filename,
+			"line":			self._origin_lineno,
+			"conditions":	[ str(condition) for condition in self.conditions ],
+			"help":			self._helptext.strip("\n") if self.have_help else None,
+			"selects":		[ { "symbol": prop.symbol.name, "condition": self._condition_record(prop.condition) } for prop in self.selects ],
+			"implies":		[ { "symbol": prop.symbol.name, "condition": self._condition_record(prop.condition) } for prop in self.implies ],
+			"defaults":		[ { "value": str(prop.value), "condition": self._condition_record(prop.condition) } for prop in self.defaults ],
+			"ranges":		[ { "from": str(prop.fromvalue), "to": str(prop.tovalue), "condition": self._condition_record(prop.condition) } for prop in self.ranges ],
+		}
+		if (reverse_dependencies is not None) and (self._symbol is not None):
+			for (kind, key) in [ ("select", "selected_by"), ("imply", "implied_by") ]:
+				record[key] = [ { "symbol": reverse_dependency.item.symbol.name, "condition": self._condition_record(reverse_dependency.condition) } for reverse_dependency in reverse_dependencies.get(self._symbol, [ ]) if reverse_dependency.kind == kind ]
+		if evaluator is not None:
+			record["blocked_by"] = [ str(clause) for clause in self.blocking_clauses(evaluator) ]
+		return record
+
+	def records(self, reverse_dependencies = None, evaluator = None):
+		# Yields one dict per visible node in dump order, each one carrying
+		# the prompts of the menus it is nested in
+		path = [ ]
+		for (depth, node) in self.walk(filter = lambda node: node._visible):
+			del path[depth:]
+			yield node._record([ entry for entry in path if entry is not None ], reverse_dependencies, evaluator)
+			if node.itemtype == ItemType.RootMenu:
+				path.append(None)
+			elif node._text is not None:
+				path.append(str(node._text))
+			elif node._symbol is not None:
+				path.append(node._symbol.name)
+			else:
+				path.append(node.unnamed_label)
 
 	def add_item(self, item):
 		item._parent = self
@@ -191,7 +445,7 @@ class ConfigItem(object):
 		return item
 
 	def _could_be_child_of(self, potential_parent):
-		return (potential_parent is not None) and (potential_parent.symbol is not None) and any(condition.requires(potential_parent.symbol) for condition in self._conditions)
+		return (potential_parent is not None) and (potential_parent.symbol in self._required_symbols)
 
 	def _reparent(self, new_parent, new_children):
 		if new_parent is None:
@@ -201,7 +455,7 @@ class ConfigItem(object):
 		for child in new_children:
 			new_parent.add_item(child)
 
-	def create_submenus(self):
+	def _create_child_submenus(self):
 		potential_parent = None
 		potential_children = [ ]
 		remaining_children = [ ]
@@ -225,16 +479,24 @@ class ConfigItem(object):
 		self._reparent(potential_parent, potential_children)
 		self._children = remaining_children
 
-		for child in self._children:
-			child.create_submenus()
+	def create_submenus(self):
+		# Children of a node are only descended into after they have been
+		# regrouped, which includes the ones that were just moved there
+		for (depth, node) in self.walk():
+			node._create_child_submenus()
 
 	def __repr__(self):
-		return "ConfigItem<%s, %s, %s, cond = %s>" % (self.itemtype.name, self.symbol, self.text, self._conditions)
+		return "ConfigItem<%s, %s, %s, cond = %s>" % (self.itemtype.name, self.symbol, self.text, self.conditions)
 
 class KConfigFileParser(object):
+	# Parsing happens in two stages: every file is first tokenized into a list
+	# of (lineno, event) tuples that does not depend on the state of the
+	# including file. These per-file event lists are then replayed in source
+	# order to build the ConfigItem tree. Since the first stage only depends
+	# on the file content, event lists can be cached by content hash.
 	_INDENT_RE = re.compile("(?P<indent>^[ \t]*).*")
 
-	def __init__(self, basedir, filename, replacements = None):
+	def __init__(self, basedir, filename, replacements = None, cache = None, jobs = 1, file_store = None):
 		self._basedir = basedir
 		if not self._basedir.endswith("/"):
 			self._basedir += "/"
@@ -243,14 +505,49 @@ class KConfigFileParser(object):
 			self._replacements = { }
 		else:
 			self._replacements = replacements
+		self._cache = cache
+		self._jobs = jobs
+		# Maps filename to (fingerprint, events). Tokenization does not depend
+		# on the replacements, so parsers for different architectures can
+		# share one store and only need to tokenize each shared file once.
+		if file_store is None:
+			self._file_store = { }
+		else:
+			self._file_store = file_store
 		self._helptext = False
 		self._helpindent = None
 		self._configparse = KConfigParser()
+		self._fastparse = KConfigFastParser()
 		self._parse_result = None
 		self._current_item = None
 		self._current_menu = None
-		self._conditions = [ ]
+		self._conditions = None
 		self._menuconfig_symbols = [ ]
+		self._fingerprints = { }
+		self._symbols = SymbolTable(list)
+		self._reverse_dependencies = SymbolTable(list)
+		self._stats = collections.Counter()
+		self._parse_stack = [ ]
+		self._tokenize_position = None
+
+	@property
+	def fingerprints(self):
+		return self._fingerprints
+
+	@property
+	def symbols(self):
+		# Maps Symbols to all ConfigItems defining them, in source order
+		return self._symbols
+
+	@property
+	def reverse_dependencies(self):
+		# Maps Symbols to the ReverseDependency entries of all items
+		# that select or imply them
+		return self._reverse_dependencies
+
+	@property
+	def stats(self):
+		return self._stats
 
 	def _add_item(self, item):
 		self._current_item = self._current_menu.add_item(item)
@@ -268,18 +565,17 @@ class KConfigFileParser(object):
 			text = text.replace(src, dst)
 		return text
 
-	def _add_helptext_line(self, filename, lineno, line = ""):
-		line = Tools.expand_tabs(line)[self._helpindent : ]
-		self._current_item.add_helptext_line(line)
+	def _tokenize_helptext_line(self, line = ""):
+		return HelpText(text = Tools.expand_tabs(line)[self._helpindent : ])
 
-	def _parse_line(self, filename, lineno, line):
+	def _tokenize_line(self, filename, lineno, line, events):
 		strippedline = line.strip()
 		if strippedline.startswith("#"):
 			return
 
 		if self._helptext:
 			if len(strippedline) == 0:
-				self._add_helptext_line(filename, lineno)
+				events.append((lineno, self._tokenize_helptext_line()))
 				return
 			indent = self._INDENT_RE.match(line).groupdict()["indent"]
 			indent_level = Tools.apparent_length(indent, tabsize = 8)
@@ -289,7 +585,7 @@ class KConfigFileParser(object):
 				# "---help---" marker.
 				if indent_level > 0:
 					self._helpindent = indent_level
-					self._add_helptext_line(filename, lineno, line)
+					events.append((lineno, self._tokenize_helptext_line(line)))
 				else:
 					self._helptext = False
 					self._helpindent = None
@@ -300,7 +596,7 @@ class KConfigFileParser(object):
 					self._helpindent = None
 				else:
 					# Continue help text
-					self._add_helptext_line(filename, lineno, line)
+					events.append((lineno, self._tokenize_helptext_line(line)))
 
 
 		if not self._helptext:
@@ -308,89 +604,195 @@ class KConfigFileParser(object):
 			if len(splitline) == 0:
 				return
 			keyword = splitline[0]
-			arguments = splitline[1:]
 
 			if keyword in [ "help", "---help---" ]:
 				self._helptext = True
+			elif keyword in [ "choice", "endchoice", "endmenu", "endif", "optional" ]:
+				events.append((lineno, Keyword(keyword = keyword)))
 			else:
-				if keyword in [ "choice", "endchoice", "endmenu", "endif", "optional" ]:
-					if keyword in [ "endmenu", "endchoice" ]:
-						self._leave_submenu()
-					elif keyword == "choice":
-						self._enter_submenu(ConfigItem(ItemType.Choice, filename = filename, lineno = lineno, conditions = self._conditions))
-					elif keyword == "endif":
-						self._conditions.pop()
+				result = self._fastparse.parse(keyword, line)
+				if result is not None:
+					self._stats["lines_fastpath"] += 1
 				else:
+					self._stats["lines_grammar"] += 1
 					try:
 						result = self._configparse.parse("ConfigurationItem", line)
 					except tpg.SyntacticError as e:
 						exception = e
 						result = None
-					if result is None:
-						print("Parsing stack:")
-						for (filename, lineno) in self._parse_stack:
-							print("   %s line %d" % (filename, lineno))
-						raise Exception("Parse error of %s%s:%d \"%s\": %s" % (self._basedir, self._parse_stack[-1][0], lineno, line, exception))
-
-					if isinstance(result, Menu):
-						self._enter_submenu(ConfigItem(ItemType.SubMenu, text = result.text, filename = filename, lineno = lineno, conditions = self._conditions))
-					elif isinstance(result, ConfigurationItem):
-						if result.conftype == "menuconfig":
-							itemtype = ItemType.MenuConfig
-						else:
-							itemtype = ItemType.Config
-						self._add_item(ConfigItem(itemtype, symbol = result.symbol, filename = filename, lineno = lineno, conditions = self._conditions))
-					elif isinstance(result, ConfigType):
-						if result.text is not None:
-							self._current_item.text = result.text
-					elif isinstance(result, Option):
-						pass
-					elif isinstance(result, DefaultValue):
-						pass
-					elif isinstance(result, DependsOn):
-						self._current_item.append_condition(result.dependency)
-					elif isinstance(result, Select):
-						pass
-					elif isinstance(result, Range):
-						pass
-					elif isinstance(result, DefType):
-						pass
-					elif isinstance(result, Comment):
-						pass
-					elif isinstance(result, VisibleIf):
-						self._current_item.append_condition(result.condition)
-					elif isinstance(result, Imply):
-						pass
-					elif isinstance(result, Conditional):
-						self._conditions.append(result.condition)
-					elif isinstance(result, Source):
-						filename = self._replace_all(result.filename.value)
-						self._parse_file(filename)
-					elif isinstance(result, Assignment):
-						pass
+				if result is None:
+					print("Parsing stack:")
+					for (stack_filename, stack_lineno) in self._parse_positions():
+						print("   %s line %d" % (stack_filename, stack_lineno))
+					raise Exception("Parse error of %s%s:%d \"%s\": %s" % (self._basedir, filename, lineno, line, exception))
+				events.append((lineno, result))
+
+	def _tokenize_file(self, filename, f):
+		self._helptext = False
+		self._helpindent = None
+		events = [ ]
+		continued_line = ""
+		self._tokenize_position = [ filename, 0 ]
+		for (lineno, line) in enumerate(f, 1):
+			self._tokenize_position[1] = lineno
+			line = line.rstrip("\r\n")
+			if line.endswith("\\"):
+				# Continuation
+				continued_line += line[:-1]
+			else:
+				self._tokenize_line(filename, lineno, continued_line + line, events)
+				continued_line = ""
+		self._tokenize_position = None
+		return events
+
+	def _parse_positions(self):
+		# Files that are being replayed together with the line of their
+		# current event, innermost last. The innermost file may still be
+		# tokenized, then its line is the one of the tokenizer.
+		positions = [ tuple(frame) for frame in self._parse_stack ]
+		if self._tokenize_position is not None:
+			if (len(positions) > 0) and (positions[-1][0] == self._tokenize_position[0]):
+				positions.pop()
+			positions.append(tuple(self._tokenize_position))
+		return positions
+
+	def _lookup_events(self, filename):
+		(fingerprint, f) = FileFingerprint.read(self._basedir + filename)
+		events = None
+		if self._cache is not None:
+			events = self._cache.load_file_events(fingerprint.digest)
+			if events is not None:
+				self._stats["files_reused"] += 1
+		return (fingerprint, f, events)
+
+	def _store_events(self, fingerprint, events):
+		self._stats["files_parsed"] += 1
+		if self._cache is not None:
+			self._cache.store_file_events(fingerprint.digest, events)
+
+	def _file_events(self, filename):
+		entry = self._file_store.get(filename)
+		if entry is None:
+			(fingerprint, f, events) = self._lookup_events(filename)
+			if events is None:
+				with f:
+					events = self._tokenize_file(filename, f)
+				self._store_events(fingerprint, events)
+			entry = (fingerprint, events)
+			self._file_store[filename] = entry
+		(fingerprint, events) = entry
+		self._fingerprints[filename] = fingerprint
+		return events
+
+	def _sourced_filenames(self, events):
+		for (lineno, event) in events:
+			if isinstance(event, Source):
+				yield self._replace_all(event.filename.value)
+
+	def _prefetch_events(self):
+		# Tokenizes all files reachable through "source" in a process pool.
+		# Files are submitted as soon as the file sourcing them is done; the
+		# tree is then built by the regular replay in source order.
+		queue = collections.deque([ self._filename ])
+		seen = set()
+		pending = { }
+		with concurrent.futures.ProcessPoolExecutor(max_workers = self._jobs) as executor:
+			while (len(queue) > 0) or (len(pending) > 0):
+				while len(queue) > 0:
+					filename = queue.popleft()
+					if filename in seen:
+						continue
+					seen.add(filename)
+					if filename in self._file_store:
+						(fingerprint, events) = self._file_store[filename]
+						queue += self._sourced_filenames(events)
+						continue
+					(fingerprint, f, events) = self._lookup_events(filename)
+					f.close()
+					if events is None:
+						pending[executor.submit(_tokenize_file_worker, self._basedir, filename)] = (filename, fingerprint)
 					else:
-						raise Exception("Parser returned unknown object: %s for %s" % (str(result), line))
+						self._file_store[filename] = (fingerprint, events)
+						queue += self._sourced_filenames(events)
+
+				if len(pending) > 0:
+					(done, not_done) = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+					for future in done:
+						(filename, fingerprint) = pending.pop(future)
+						(events, stats) = future.result()
+						self._stats += stats
+						self._store_events(fingerprint, events)
+						self._file_store[filename] = (fingerprint, events)
+						queue += self._sourced_filenames(events)
+
+	def _replay_event(self, filename, lineno, event):
+		if isinstance(event, HelpText):
+			self._current_item.add_helptext_line(event.text)
+		elif isinstance(event, Keyword):
+			if event.keyword in [ "endmenu", "endchoice" ]:
+				self._leave_submenu()
+			elif event.keyword == "choice":
+				self._enter_submenu(ConfigItem(ItemType.Choice, filename = filename, lineno = lineno, enclosing_conditions = self._conditions))
+			elif event.keyword == "endif":
+				if self._conditions is None:
+					raise IndexError("endif without matching if")
+				self._conditions = self._conditions.parent
+		elif isinstance(event, Menu):
+			self._enter_submenu(ConfigItem(ItemType.SubMenu, text = event.text, filename = filename, lineno = lineno, enclosing_conditions = self._conditions))
+		elif isinstance(event, ConfigurationItem):
+			if event.conftype == "menuconfig":
+				itemtype = ItemType.MenuConfig
+			else:
+				itemtype = ItemType.Config
+			self._add_item(ConfigItem(itemtype, symbol = event.symbol, filename = filename, lineno = lineno, enclosing_conditions = self._conditions))
+			self._symbols[event.symbol].append(self._current_item)
+		elif isinstance(event, ConfigType):
+			if event.text is not None:
+				self._current_item.text = event.text
+		elif isinstance(event, Option):
+			pass
+		elif isinstance(event, (DefaultValue, Range, DefType)):
+			self._current_item.add_property(event)
+		elif isinstance(event, DependsOn):
+			self._current_item.append_condition(event.dependency)
+		elif isinstance(event, (Select, Imply)):
+			self._current_item.add_property(event)
+			if self._current_item.symbol is not None:
+				kind = "select" if isinstance(event, Select) else "imply"
+				self._reverse_dependencies[event.symbol].append(ReverseDependency(kind = kind, item = self._current_item, condition = event.condition))
+		elif isinstance(event, Comment):
+			pass
+		elif isinstance(event, VisibleIf):
+			self._current_item.append_condition(event.condition)
+		elif isinstance(event, Conditional):
+			self._conditions = ConditionFrame.push(self._conditions, event.condition)
+		elif isinstance(event, Source):
+			filename = self._replace_all(event.filename.value)
+			self._parse_file(filename)
+		elif isinstance(event, Assignment):
+			pass
+		else:
+			raise Exception("Parser returned unknown object: %s" % (str(event)))
 
 	def _parse_file(self, filename):
 		self._parse_stack.append([ filename, 0 ])
-		with open(self._basedir + filename) as f:
-			continued_line = ""
-			for (lineno, line) in enumerate(f, 1):
-				line = line.rstrip("\r\n")
-				if line.endswith("\\"):
-					# Continuation
-					continued_line += line[:-1]
-				else:
-					self._parse_stack[-1][1] = lineno
-					self._parse_line(filename, lineno, continued_line + line)
-					continued_line = ""
+		events = self._file_events(filename)
+		for (lineno, event) in events:
+			self._parse_stack[-1][1] = lineno
+			self._replay_event(filename, lineno, event)
 		self._parse_stack.pop()
 
 	def _parse(self):
 		self._parse_stack = [ ]
+		self._tokenize_position = None
+		self._conditions = None
+		self._symbols = SymbolTable(list)
+		self._reverse_dependencies = SymbolTable(list)
 		self._parse_result = ConfigItem(ItemType.RootMenu, text = self._filename, filename = self._filename, lineno = 0)
 		self._current_menu = self._parse_result
 		self._current_item = self._parse_result
+		if self._jobs > 1:
+			self._prefetch_events()
 		self._parse_file(self._filename)
 		return self._parse_result
 
@@ -399,16 +801,30 @@ class KConfigFileParser(object):
 			return self._parse()
 		except (IndexError, AssertionError) as e:
 			print("Parsing error:")
-			for (filename, lineno) in reversed(self._parse_stack):
+			for (filename, lineno) in reversed(self._parse_positions()):
 				print("    %s%s line %d" % (self._basedir, filename, lineno))
 			print()
 			print("Caused %s" % (e))
 			sys.exit(1)
 
 
+_worker_parser = None
+
+def _tokenize_file_worker(basedir, filename):
+	# Runs in a worker process of KConfigFileParser._prefetch_events
+	global _worker_parser
+	if _worker_parser is None:
+		_worker_parser = KConfigFileParser(basedir, filename)
+	_worker_parser.stats.clear()
+	(fingerprint, f) = FileFingerprint.read(basedir + filename)
+	with f:
+		events = _worker_parser._tokenize_file(filename, f)
+	return (events, _worker_parser.stats)
+
 class KConfigScanner(object):
-	_SearchSpec = collections.namedtuple("SearchSpec", [ "regex", "include_unnamed" ])
-	_DumpSpec = collections.namedtuple("DumpSpec", [ "show_origin", "show_help", "show_conditions", "show_key", "kconfig" ])
+	_SearchSpec = collections.namedtuple("SearchSpec", [ "regex", "include_unnamed", "fields", "literals" ])
+	_DumpSpec = collections.namedtuple("DumpSpec", [ "show_origin", "show_help", "show_conditions", "show_key", "kconfig", "reverse_dependencies", "evaluator" ])
+	_OUTPUT_BUFFER_SIZE = 64 * 1024
 
 	def __init__(self, args):
 		self._args = args
@@ -418,24 +834,125 @@ class KConfigScanner(object):
 		else:
 			self._kconfig = None
 
-	def scan(self):
+		if self._args.no_cache:
+			self._cache = None
+		else:
+			self._cache = KConfigCache(self._args.cache_dir)
+		self._file_store = { }
+		self._json_encoder = json.JSONEncoder()
+		self._records_written = False
+
+	def _architectures(self):
+		if not self._args.all_arches:
+			return self._args.arch.split(",")
+		archdir = self._basedir + "arch/"
+		return sorted(arch for arch in os.listdir(archdir) if os.path.isfile(archdir + arch + "/Kconfig"))
+
+	def _parse(self, arch):
 		variables = {
-			"$SRCARCH":		self._args.arch,
-			"$(SRCARCH)":	self._args.arch,
+			"$SRCARCH":		arch,
+			"$(SRCARCH)":	arch,
 		}
-		rootnode = KConfigFileParser(self._basedir, self._args.startfile, variables).parse()
+
+		if self._cache is not None:
+			cached = self._cache.load_tree(self._basedir, self._args.startfile, variables)
+			if cached is not None:
+				if self._args.stats:
+					print("%s: Kconfig tree loaded from cache." % (arch), file = sys.stderr)
+				return cached
+
+		parser = KConfigFileParser(self._basedir, self._args.startfile, variables, cache = self._cache, jobs = self._args.jobs, file_store = self._file_store)
+		rootnode = parser.parse()
+		if self._args.stats:
+			shared = len(parser.fingerprints) - parser.stats["files_reused"] - parser.stats["files_parsed"]
+			print("%s: %d Kconfig files: %d shared with previous architecture, %d reused from cache, %d parsed." % (arch, len(parser.fingerprints), shared, parser.stats["files_reused"], parser.stats["files_parsed"]), file = sys.stderr)
+			print("%s: %d lines parsed by fast path, %d by grammar." % (arch, parser.stats["lines_fastpath"], parser.stats["lines_grammar"]), file = sys.stderr)
+		symbols = parser.symbols
+		reverse_dependencies = parser.reverse_dependencies
+		if self._cache is None:
+			# Building the index costs more than a single linear search, it
+			# only pays off when it is persisted for subsequent runs
+			return (rootnode, None, symbols, reverse_dependencies)
+		index = KConfigIndex(rootnode)
+		tree = (rootnode, index, symbols, reverse_dependencies)
+		self._cache.store_tree(self._basedir, self._args.startfile, variables, parser.fingerprints, tree)
+		return tree
+
+	def scan(self):
+		fields = self._args.search_fields.split(",")
 		if self._args.search is None:
-			search_spec = self._SearchSpec(regex = None, include_unnamed = self._args.include_unnamed)
+			search_spec = self._SearchSpec(regex = None, include_unnamed = self._args.include_unnamed, fields = fields, literals = [ ])
 		else:
 			regex = re.compile(self._args.search, flags = 0 if self._args.no_ignore_case else re.IGNORECASE)
-			search_spec = self._SearchSpec(regex = regex, include_unnamed = self._args.include_unnamed)
-		if not self._args.no_submenus:
-			rootnode.create_submenus()
-		result = rootnode.enable_visibility(search_spec)
-
-		if result == 0:
-			print("Sorry, no search results that matched your criteria.")
+			search_spec = self._SearchSpec(regex = regex, include_unnamed = self._args.include_unnamed, fields = fields, literals = KConfigIndex.required_literals(regex))
+		dump_spec = self._DumpSpec(show_origin = self._args.show_origin, show_help = self._args.show_help, show_conditions = self._args.show_conditions, show_key = True, kconfig = self._kconfig, reverse_dependencies = None, evaluator = None)
+
+		# ndjson is meant to be consumed while the scan is running, so each
+		# record is flushed as soon as its line is complete
+		buffering = 1 if (self._args.format == "ndjson") else self._OUTPUT_BUFFER_SIZE
+		with open(self._args.output_fd, "w", buffering = buffering, encoding = sys.stdout.encoding, errors = sys.stdout.errors, closefd = False) as writer:
+			if self._args.format == "json":
+				writer.write("[")
+			self._scan(search_spec, dump_spec, writer)
+			if self._args.format == "json":
+				writer.write("\n]\n")
+
+	def _write_records(self, arch, rootnode, dump_spec, writer):
+		# Records are encoded and written one by one, so consumers can
+		# process them while the tree is still being walked
+		encode = self._json_encoder.encode
+		if self._args.format == "json":
+			separator = ",\n" if self._records_written else "\n"
+			for record in rootnode.records(dump_spec.reverse_dependencies, dump_spec.evaluator):
+				record["arch"] = arch
+				writer.write(separator + encode(record))
+				separator = ",\n"
+				self._records_written = True
 		else:
-			dump_spec = self._DumpSpec(show_origin = self._args.show_origin, show_help = self._args.show_help, show_conditions = self._args.show_conditions, show_key = True, kconfig = self._kconfig)
-			rootnode.dump(dump_spec)
+			for record in rootnode.records(dump_spec.reverse_dependencies, dump_spec.evaluator):
+				record["arch"] = arch
+				writer.write(encode(record) + "\n")
+
+	def _enable_symbols(self, symbols):
+		# Exact lookup, shows every definition of the given symbols
+		count = 0
+		for name in self._args.symbol.split(","):
+			if name.startswith("CONFIG_"):
+				name = name[7:]
+			symbol = Symbol.lookup(name)
+			if symbol is None:
+				continue
+			for node in symbols.get(symbol, [ ]):
+				node.set_visible()
+				count += 1
+		return count
+
+	def _scan(self, search_spec, dump_spec, writer):
+		arches = self._architectures()
+		for arch in arches:
+			(rootnode, index, symbols, reverse_dependencies) = self._parse(arch)
+			if self._args.show_selected_by:
+				dump_spec = dump_spec._replace(reverse_dependencies = reverse_dependencies)
+			if self._kconfig is not None:
+				dump_spec = dump_spec._replace(evaluator = KConfigEvaluator(self._kconfig, symbols))
+			if not self._args.no_submenus:
+				rootnode.create_submenus()
+			if self._args.symbol is None:
+				result = rootnode.enable_visibility(search_spec, index)
+			else:
+				result = self._enable_symbols(symbols)
+
+			if self._args.format != "text":
+				self._write_records(arch, rootnode, dump_spec, writer)
+			elif len(arches) > 1:
+				writer.write("Architecture %s: %d matching options\n" % (arch, result))
+				if result > 0:
+					rootnode.dump(dump_spec, indent = 1, writer = writer)
+			elif result == 0:
+				writer.write("Sorry, no search results that matched your criteria.\n")
+			else:
+				rootnode.dump(dump_spec, writer = writer)
+			# Anything printed while parsing the next architecture must not
+			# overtake output that is still buffered
+			writer.flush()
 
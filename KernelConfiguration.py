@@ -1,5 +1,8 @@
+import os
 import re
 import enum
+import mmap
+import array
 
 class ConfigOptionState(enum.IntEnum):
 	Disabled = 1
@@ -7,26 +10,91 @@ class ConfigOptionState(enum.IntEnum):
 	Module = 3
 
 class KernelConfiguration(object):
-	def __init__(self, filename):
+	# Values are typed: tristate values become a ConfigOptionState (with
+	# "# CONFIG_FOO is not set" meaning Disabled), quoted strings are
+	# unquoted and unescaped, decimal and hexadecimal numbers become ints.
+	# The whole file is scanned with a single regex instead of line by line,
+	# optionally through a memory map. Later entries override earlier ones.
+	_ENTRY_RE = re.compile(rb"^(?:CONFIG_([^=\s]+)=([^\r\n]*)|# CONFIG_(\S+) is not set)\r?$", flags = re.MULTILINE)
+	_DECIMAL_RE = re.compile(rb"-?\d+")
+	_HEX_RE = re.compile(rb"0[xX][0-9a-fA-F]+")
+	_ESCAPE_RE = re.compile(r"\\(.)")
+	_TRISTATE_VALUES = {
+		b"y":	ConfigOptionState.Enabled,
+		b"n":	ConfigOptionState.Disabled,
+		b"m":	ConfigOptionState.Module,
+	}
+
+	def __init__(self, filename, use_mmap = False):
 		self._filename = filename
 		self._keys = { }
-		self._parse()
-
-	def _parse(self):
-		with open(self._filename) as f:
-			for line in f:
-				line = line.rstrip("\r\n")
-				if not line.startswith("CONFIG_"):
-					continue
-				(key, value) = line.split("=", maxsplit = 1)
-				key = key[7:]
-				if value == "y":
-					value = ConfigOptionState.Enabled
-				elif value == "n":
-					value = ConfigOptionState.Disabled
-				elif value == "m":
-					value = ConfigOptionState.Module
-				self._keys[key] = value
+		self._states = array.array("B")
+		self._parse(use_mmap)
+
+	@classmethod
+	def load_all(cls, filenames, use_mmap = False):
+		return [ cls(filename, use_mmap = use_mmap) for filename in filenames ]
+
+	@property
+	def filename(self):
+		return self._filename
+
+	@classmethod
+	def _typed_value(cls, value):
+		state = cls._TRISTATE_VALUES.get(value)
+		if state is not None:
+			return state
+		elif value.startswith(b"\"") and value.endswith(b"\"") and (len(value) >= 2):
+			return cls._ESCAPE_RE.sub(r"\1", value[1 : -1].decode())
+		elif cls._DECIMAL_RE.fullmatch(value):
+			return int(value)
+		elif cls._HEX_RE.fullmatch(value):
+			return int(value, 16)
+		else:
+			return value.decode()
+
+	def _parse_data(self, data):
+		# Matching bytes is considerably faster than matching str
+		keys = self._keys
+		tristate_values = self._TRISTATE_VALUES
+		for (key, value, unset_key) in self._ENTRY_RE.findall(data):
+			if len(unset_key) > 0:
+				keys[unset_key.decode()] = ConfigOptionState.Disabled
+			else:
+				# Tristate values are by far the most common, avoid a call
+				state = tristate_values.get(value)
+				keys[key.decode()] = self._typed_value(value) if (state is None) else state
+
+	def _parse(self, use_mmap):
+		with open(self._filename, "rb") as f:
+			if use_mmap and (os.fstat(f.fileno()).st_size > 0):
+				with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as data:
+					self._parse_data(data)
+			else:
+				self._parse_data(f.read())
 
 	def __getitem__(self, key):
 		return self._keys.get(key)
+
+	def __len__(self):
+		return len(self._keys)
+
+	def state_array(self, symbol_table):
+		# One byte per symbol name of symbol_table, in its order: the
+		# ConfigOptionState of tristate symbols, 0 for all others
+		states = array.array("B", bytes(len(symbol_table)))
+		for (index, name) in enumerate(symbol_table):
+			value = self._keys.get(name)
+			if isinstance(value, ConfigOptionState):
+				states[index] = value
+		return states
+
+	def state(self, symbol):
+		# ConfigOptionState of a tristate Symbol object or 0, looked up by the
+		# symbol's ID. The state array is rebuilt whenever symbols have been
+		# registered since, which in practice happens once per parsed tree.
+		try:
+			return self._states[symbol.id]
+		except IndexError:
+			self._states = self.state_array(symbol.names())
+			return self._states[symbol.id]
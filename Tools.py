@@ -30,9 +30,11 @@ _COLORS = {
 	"gray":		37,
 }
 
+_COLOR_ESCAPES = { color: "\x1b[%dm" % (colorcode) for (color, colorcode) in _COLORS.items() }
+_RESET_ESCAPE = "\x1b[0m"
+
 def colorize_text(text, color):
-	colorcode = _COLORS[color]
-	return "\x1b[%dm%s\x1b[0m" % (colorcode, text)
+	return "%s%s%s" % (_COLOR_ESCAPES[color], text, _RESET_ESCAPE)
 
 def expand_tabs(text, tabsize = 8):
 	result = ""